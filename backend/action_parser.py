@@ -0,0 +1,127 @@
+# FILE: backend/action_parser.py
+# =============================================================================
+# ACTION PARSER
+# =============================================================================
+# Finds the JSON action in a Claude reply and cuts it out of the reply text.
+# Kept free of app imports and fully annotated so the Docker build can
+# compile it to a native extension with mypyc. Run locally, the plain .py
+# is imported as usual.
+# =============================================================================
+
+import re
+from collections.abc import Iterator
+
+import orjson
+
+# Collapses the gap left behind once the action JSON is cut from a reply
+_BLANK_LINES = re.compile(r"\n{3,}")
+
+
+# Restarts allowed after an unclosed "{"; bounds the scan at O(N) per restart
+_MAX_RESCANS = 4
+
+
+def _find_json_spans(text: str) -> Iterator[tuple[int, int]]:
+    """
+    Yields (start, end) offsets of each balanced top-level {...} span.
+    Linear pass over the text, tracking open braces and JSON string state.
+
+    A "{" that never closes (e.g. a stray brace in prose) may have thrown the
+    string state off, so the text after it is rescanned, at most _MAX_RESCANS
+    times. Once that budget is spent, the outermost spans closed inside the
+    unclosed brace are yielded as found.
+    """
+    n = len(text)
+    pos = 0
+    rescans = 0
+    while True:
+        opens: list[int] = []
+        nested: list[tuple[int, int]] = []
+        in_str = False
+        esc = False
+        for i in range(pos, n):
+            c = text[i]
+            if in_str:
+                if esc:
+                    esc = False
+                elif c == "\\":
+                    esc = True
+                elif c == '"':
+                    in_str = False
+            elif c == "{":
+                opens.append(i)
+            elif c == "}" and opens:
+                start = opens.pop()
+                if opens:
+                    nested.append((start, i + 1))
+                else:
+                    nested.clear()
+                    yield start, i + 1
+            elif c == '"' and opens:
+                in_str = True
+
+        if not opens:
+            return
+        if rescans < _MAX_RESCANS:
+            rescans += 1
+            pos = opens[0] + 1
+            continue
+
+        # Spans close in end order and nest properly, so walking back from the
+        # last one, a span is outermost iff it starts before every span kept
+        outermost: list[tuple[int, int]] = []
+        min_start = n
+        for j in range(len(nested) - 1, -1, -1):
+            if nested[j][0] < min_start:
+                outermost.append(nested[j])
+                min_start = nested[j][0]
+        for j in range(len(outermost) - 1, -1, -1):
+            yield outermost[j]
+        return
+
+
+def _widen_to_fence(text: str, start: int, end: int) -> tuple[int, int]:
+    """Extends a JSON span to cover a surrounding ```json fence or `backticks`."""
+    i = start
+    while i > 0 and text[i - 1].isspace():
+        i -= 1
+    j = end
+    while j < len(text) and text[j].isspace():
+        j += 1
+
+    if text.startswith("```", j):
+        for opener in ("```json", "```"):
+            if text.endswith(opener, 0, i):
+                return i - len(opener), j + 3
+    if text.endswith("`", 0, start) and text.startswith("`", end):
+        return start - 1, end + 1
+    return start, end
+
+
+def extract_action(text: str) -> tuple[dict | None, int, int]:
+    """
+    Returns (action, start, end) where text[start:end] is the action JSON
+    (including any code fence around it), or (None, 0, 0) if there is none.
+    """
+    for start, end in _find_json_spans(text):
+        try:
+            parsed = orjson.loads(text[start:end])
+        except orjson.JSONDecodeError:
+            continue
+
+        action_type = parsed.get("type") or parsed.get("action")
+        if action_type and isinstance(action_type, str):
+            if "action" in parsed and "type" not in parsed:
+                parsed["type"] = parsed.pop("action")
+            start, end = _widen_to_fence(text, start, end)
+            return parsed, start, end
+
+    return None, 0, 0
+
+
+def split_action(reply_text: str) -> tuple[str, dict | None]:
+    """Returns (reply, action) with the action JSON cut out of the reply."""
+    action, start, end = extract_action(reply_text)
+    if action:
+        reply_text = _BLANK_LINES.sub("\n\n", reply_text[:start] + reply_text[end:])
+    return reply_text.strip(), action
@@ -7,21 +7,36 @@
 # =============================================================================
 
 import os
-import json
+import sys
+import time
+import asyncio
+import hashlib
+import functools
 import logging
-from datetime import datetime, timedelta
-from typing import Optional, Tuple, Dict, Any
+import threading
+from datetime import date, timedelta
+from collections.abc import AsyncIterator
+from typing import Annotated, Any
 
-from fastapi import FastAPI, HTTPException, Request, Depends, Header
+from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from pydantic import BaseModel
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, ValidationError
 
 import anthropic
+import httpx
+import orjson
+from cachetools import TTLCache
 
-# Firebase token verification (google-auth)
-from google.auth.transport import requests as google_requests
-from google.oauth2 import id_token as google_id_token
+# Claude reply post-processing (compiled with mypyc in the Docker image)
+from action_parser import split_action
+
+# Firebase token verification (PyJWT + cached Google JWKS)
+import jwt
+from jwt import PyJWKClient
 
 # -----------------------------------------------------------------------------
 # CONFIGURATION
@@ -41,6 +56,13 @@ MODEL = os.environ.get("CLAUDE_MODEL", "claude-sonnet-4-20250514")
 # For Firebase ID tokens: aud == project_id, iss == https://securetoken.google.com/<project_id>
 FIREBASE_PROJECT_ID = os.environ.get("FIREBASE_PROJECT_ID", "").strip()
 
+# Shared async Claude client: one connection pool reused across requests
+_anthropic = anthropic.AsyncAnthropic(
+    api_key=ANTHROPIC_API_KEY,
+    max_retries=2,
+    timeout=httpx.Timeout(30.0, connect=5.0),
+)
+
 # -----------------------------------------------------------------------------
 # LOGGING
 # -----------------------------------------------------------------------------
@@ -59,6 +81,7 @@ app = FastAPI(
     title="FamilyFlow Assistant API",
     description="Cloud backend for FamilyFlow homeschool management app",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 app.add_middleware(
@@ -73,17 +96,22 @@ app.add_middleware(
 # REQUEST/RESPONSE MODELS
 # -----------------------------------------------------------------------------
 
+# Upper bounds on chat payloads; larger requests are rejected with 422
+MAX_TEXT_CHARS = 16_000
+MAX_CONTEXT_CHARS = 64_000
+
+
 class ChatRequest(BaseModel):
-    text: str
-    familyId: Optional[str] = None
-    userId: Optional[str] = None
-    userEmail: Optional[str] = None
-    context: Optional[str] = None  # optional data context from app
+    text: Annotated[str, Field(min_length=1, max_length=MAX_TEXT_CHARS)]
+    familyId: str | None = None
+    userId: str | None = None
+    userEmail: str | None = None
+    context: Annotated[str | None, Field(max_length=MAX_CONTEXT_CHARS)] = None  # optional data context from app
 
 
 class ChatResponse(BaseModel):
     reply: str
-    action: Optional[dict] = None
+    action: dict | None = None
 
 
 # -----------------------------------------------------------------------------
@@ -92,60 +120,152 @@ class ChatResponse(BaseModel):
 
 FIREBASE_PROJECT_ID = os.environ.get("FIREBASE_PROJECT_ID", "").strip()
 
-_google_request = google_requests.Request()
+# Google's public signing keys for Firebase ID tokens, in JWKS form.
+# The key set is cached for an hour; a token with an unknown `kid` can force
+# an early refetch at most once per FIREBASE_JWKS_REFRESH_SECONDS, so forged
+# headers can't turn every request into an outbound fetch.
+FIREBASE_JWKS_URL = (
+    "https://www.googleapis.com/service_accounts/v1/jwk/"
+    "securetoken@system.gserviceaccount.com"
+)
+FIREBASE_JWKS_REFRESH_SECONDS = 60
+_jwks = PyJWKClient(FIREBASE_JWKS_URL, cache_keys=True, lifespan=3600, timeout=5)
+_jwks_refresh_lock = threading.Lock()
+_jwks_forced_refresh_at = float("-inf")
 
+
+def _get_signing_key(kid: str | None) -> jwt.PyJWK | None:
+    """Looks `kid` up in the cached key set, refetching on a miss only if allowed."""
+    global _jwks_forced_refresh_at
+
+    for key in _jwks.get_signing_keys():
+        if key.key_id == kid:
+            return key
+
+    with _jwks_refresh_lock:
+        now = time.monotonic()
+        if now - _jwks_forced_refresh_at < FIREBASE_JWKS_REFRESH_SECONDS:
+            return None
+        _jwks_forced_refresh_at = now
+
+    for key in _jwks.get_signing_keys(refresh=True):
+        if key.key_id == kid:
+            return key
+    return None
+
+
+# Already-verified tokens: sha256(token) -> trimmed claims. Entries live at
+# most 5 minutes and stop being served 30s before the token's own exp.
+_verified_tokens: TTLCache = TTLCache(maxsize=4096, ttl=300)
+_verified_tokens_lock = threading.Lock()
+_CACHED_CLAIM_FIELDS = ("user_id", "sub", "email", "exp", "iss")
+_TOKEN_EXP_SKEW = 30
+
+# Parses "Authorization: Bearer <token>"; auto_error=False so we raise our own 401
+_bearer = HTTPBearer(auto_error=False)
+
+# Kept as a plain `def` on purpose: it is run in the threadpool (see
+# read_authed_chat_request), so a JWKS refresh or RSA verify never stalls
+# the event loop.
 def require_firebase_user(
-    authorization: Optional[str] = Header(default=None),
-) -> Dict[str, Any]:
+    creds: HTTPAuthorizationCredentials | None = Depends(_bearer),
+) -> dict[str, Any]:
     """
     Requires Authorization: Bearer <Firebase ID token>
     Returns decoded claims if valid, otherwise raises 401.
     """
-    if not authorization:
-        raise HTTPException(status_code=401, detail="Missing Authorization header.")
-    if not authorization.lower().startswith("bearer "):
+    # HTTPBearer yields None for a missing header, a non-Bearer scheme or an empty token
+    if creds is None:
         raise HTTPException(status_code=401, detail="Authorization must be: Bearer <token>")
 
-    token = authorization.split(" ", 1)[1].strip()
-    if not token:
-        raise HTTPException(status_code=401, detail="Empty bearer token.")
+    token = creds.credentials
+
+    cache_key = hashlib.sha256(token.encode()).digest()
+    with _verified_tokens_lock:
+        cached = _verified_tokens.get(cache_key)
+    if cached is not None and cached["exp"] - _TOKEN_EXP_SKEW > time.time():
+        return cached
 
     try:
-        # If FIREBASE_PROJECT_ID is set, enforce aud via audience=
+        signing_key = _get_signing_key(jwt.get_unverified_header(token).get("kid"))
+        if signing_key is None:
+            raise jwt.InvalidTokenError("Unknown signing key id")
+
+        # If FIREBASE_PROJECT_ID is set, enforce aud + iss; otherwise only the
+        # signature and expiry are checked.
         if FIREBASE_PROJECT_ID:
-            claims = google_id_token.verify_firebase_token(
+            claims = jwt.decode(
                 token,
-                _google_request,
+                signing_key.key,
+                algorithms=["RS256"],
                 audience=FIREBASE_PROJECT_ID,
+                issuer=f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}",
+                options={"require": ["exp", "iat", "sub"]},
             )
         else:
-            claims = google_id_token.verify_firebase_token(token, _google_request)
+            claims = jwt.decode(
+                token,
+                signing_key.key,
+                algorithms=["RS256"],
+                options={"require": ["exp", "iat", "sub"], "verify_aud": False},
+            )
 
     except Exception:
         # Don’t leak internals to the client; log server-side instead
         logger.exception("Invalid Firebase ID token")
         raise HTTPException(status_code=401, detail="Invalid Firebase ID token.")
 
-    # Optional strict issuer check (audience already checked above if set)
-    if FIREBASE_PROJECT_ID:
-        iss = claims.get("iss")
-        expected_iss = f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}"
-        if iss != expected_iss:
-            raise HTTPException(status_code=401, detail="Token project mismatch.")
+    claims = {k: claims[k] for k in _CACHED_CLAIM_FIELDS if k in claims}
+    if claims["exp"] - _TOKEN_EXP_SKEW > time.time():
+        with _verified_tokens_lock:
+            _verified_tokens[cache_key] = claims
 
     return claims
 
 
+async def read_authed_chat_request(
+    http_request: Request,
+    creds: HTTPAuthorizationCredentials | None,
+) -> tuple[ChatRequest, dict[str, Any]]:
+    """
+    Verifies the token while the body is still being received and parsed,
+    instead of FastAPI's parse-then-authenticate order. An auth failure
+    still wins over a bad body (401 before 422).
+    """
+    auth_task = asyncio.ensure_future(run_in_threadpool(require_firebase_user, creds))
+
+    try:
+        body = await http_request.body()
+    except BaseException:
+        auth_task.cancel()
+        raise
+
+    try:
+        request = ChatRequest.model_validate_json(body)
+    except ValidationError as e:
+        await auth_task
+        # Same shape as FastAPI's own body errors: every loc starts with "body"
+        errors = [{**err, "loc": ("body", *err["loc"])} for err in e.errors(include_url=False)]
+        raise RequestValidationError(errors, body=body)
+
+    return request, await auth_task
+
+
+# The chat endpoints read their body by hand, so document it explicitly
+_CHAT_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": ChatRequest.model_json_schema()}},
+    }
+}
+
+
 
 # -----------------------------------------------------------------------------
 # SYSTEM PROMPT
 # -----------------------------------------------------------------------------
 
-def build_system_prompt(context: Optional[str] = None) -> str:
-    today = datetime.now().strftime("%Y-%m-%d")
-    tomorrow = (datetime.now().replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)).strftime("%Y-%m-%d")
-
-    base_prompt = f"""You are a helpful homeschool assistant for FamilyFlow.
+_BASE_TEMPLATE = """You are a helpful homeschool assistant for FamilyFlow.
 
 TODAY'S DATE: {today}
 
@@ -190,11 +310,12 @@ IMPORTANT RULES:
 - If you're unsure what the user wants, ask for clarification
 """
 
-    if context:
-        base_prompt += f"""
+_CONTEXT_SECTION = """
 
 CURRENT DATA IN THE APP:
-{context}
+"""
+
+_CONTEXT_FOOTER = """
 
 Use this information to:
 - Reference students/subjects by their exact names
@@ -202,6 +323,22 @@ Use this information to:
 - Answer questions about completion rates, grades, etc.
 """
 
+
+@functools.lru_cache(maxsize=8)
+def _base_prompt(today: str, tomorrow: str) -> str:
+    # Only changes once a day, so format it once per date
+    return _BASE_TEMPLATE.format(today=today, tomorrow=tomorrow)
+
+
+def build_system_prompt(context: str | None = None) -> str:
+    today = date.today()
+    tomorrow = today + timedelta(days=1)
+
+    base_prompt = _base_prompt(today.isoformat(), tomorrow.isoformat())
+
+    if context:
+        return "".join((base_prompt, _CONTEXT_SECTION, context, _CONTEXT_FOOTER))
+
     return base_prompt
 
 
@@ -209,81 +346,151 @@ Use this information to:
 # CLAUDE API CALL
 # -----------------------------------------------------------------------------
 
-def call_claude(message: str, context: Optional[str] = None) -> Tuple[str, Optional[dict]]:
+async def call_claude(message: str, context: str | None = None) -> tuple[str, dict | None]:
     if not ANTHROPIC_API_KEY:
         return "Sorry, the assistant is not configured. Please set the API key.", None
 
-    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-
     try:
-        response = client.messages.create(
+        response = await _anthropic.messages.create(
             model=MODEL,
             max_tokens=1024,
             system=build_system_prompt(context),
             messages=[{"role": "user", "content": message}],
         )
 
-        reply_text = ""
-        for block in response.content:
-            if hasattr(block, "text"):
-                reply_text += block.text
-
-        action = extract_action(reply_text)
-        if action:
-            reply_text = clean_reply(reply_text)
+        reply_text = "".join(block.text for block in response.content if hasattr(block, "text"))
 
-        return reply_text.strip(), action
+        return split_action(reply_text)
 
     except anthropic.APIError as e:
-        logger.error(f"Anthropic API error: {e}")
+        logger.error("Anthropic API error: %s", e)
         return f"Sorry, there was an API error: {str(e)}", None
     except Exception as e:
-        logger.error(f"Unexpected error: {e}")
+        logger.error("Unexpected error: %s", e)
         return f"Sorry, something went wrong: {str(e)}", None
 
 
-def extract_action(text: str) -> Optional[dict]:
-    import re
+# Streamed deltas are coalesced until this many characters or seconds pass
+STREAM_FLUSH_CHARS = 1024
+STREAM_FLUSH_SECONDS = 0.1
 
-    patterns = [
-        r'\{[^{}]*"type"\s*:\s*"[^"]+"[^{}]*\}',
-        r'\{[^{}]*"action"\s*:\s*"[^"]+"[^{}]*\}',
-        r'```json\s*(\{.*?\})\s*```',
-        r'`(\{[^`]+\})`',
-    ]
 
-    for pattern in patterns:
-        matches = re.findall(pattern, text, re.DOTALL | re.IGNORECASE)
-        for match in matches:
-            try:
-                json_str = match if isinstance(match, str) else match
-                json_str = json_str.strip()
-                if not json_str.startswith("{"):
-                    continue
+def _sse(data: dict, event: str | None = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {orjson.dumps(data).decode()}\n\n"
 
-                parsed = json.loads(json_str)
 
-                action_type = parsed.get("type") or parsed.get("action")
-                if action_type and isinstance(action_type, str):
-                    if "action" in parsed and "type" not in parsed:
-                        parsed["type"] = parsed.pop("action")
-                    return parsed
+async def stream_claude(message: str, context: str | None = None) -> AsyncIterator[str]:
+    """
+    Streams Claude's reply as Server-Sent Events:
+      data: {"delta": "..."}                      raw text as it arrives
+      event: action / data: {"reply", "action"}   cleaned reply + parsed action
+      event: error  / data: {"reply", "action"}   on failure
+    """
+    if not ANTHROPIC_API_KEY:
+        yield _sse(
+            {"reply": "Sorry, the assistant is not configured. Please set the API key.", "action": None},
+            event="error",
+        )
+        return
+
+    loop = asyncio.get_running_loop()
+    parts: list[str] = []
+    pending: list[str] = []
+    pending_chars = 0
+    # -inf so the first delta goes out as soon as it arrives
+    last_flush = float("-inf")
+
+    def flush() -> str:
+        nonlocal pending_chars, last_flush
+        event = _sse({"delta": "".join(pending)})
+        pending.clear()
+        pending_chars = 0
+        last_flush = loop.time()
+        return event
 
-            except json.JSONDecodeError:
-                continue
+    try:
+        async with _anthropic.messages.stream(
+            model=MODEL,
+            max_tokens=1024,
+            system=build_system_prompt(context),
+            messages=[{"role": "user", "content": message}],
+        ) as stream:
+            chunks = stream.text_stream.__aiter__()
+            next_chunk: asyncio.Future | None = None
+            try:
+                while True:
+                    if next_chunk is None:
+                        next_chunk = asyncio.ensure_future(chunks.__anext__())
+
+                    # While text is pending, wake up when its window closes even
+                    # if the model is pausing; asyncio.wait doesn't cancel the read
+                    timeout = None
+                    if pending:
+                        timeout = max(0.0, last_flush + STREAM_FLUSH_SECONDS - loop.time())
+                    done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+                    if not done:
+                        yield flush()
+                        continue
+
+                    try:
+                        text = next_chunk.result()
+                    except StopAsyncIteration:
+                        break
+                    finally:
+                        next_chunk = None
+
+                    parts.append(text)
+                    pending.append(text)
+                    pending_chars += len(text)
+                    if pending_chars >= STREAM_FLUSH_CHARS or loop.time() - last_flush >= STREAM_FLUSH_SECONDS:
+                        yield flush()
+            finally:
+                if next_chunk is not None:
+                    next_chunk.cancel()
+
+        if pending:
+            yield flush()
+
+        reply, action = split_action("".join(parts))
+        yield _sse({"reply": reply, "action": action}, event="action")
 
-    return None
+    except anthropic.APIError as e:
+        logger.error("Anthropic API error: %s", e)
+        yield _sse({"reply": f"Sorry, there was an API error: {str(e)}", "action": None}, event="error")
+    except Exception as e:
+        logger.error("Unexpected error: %s", e)
+        yield _sse({"reply": f"Sorry, something went wrong: {str(e)}", "action": None}, event="error")
 
 
-def clean_reply(text: str) -> str:
-    import re
+# -----------------------------------------------------------------------------
+# STARTUP WARM-UP
+# -----------------------------------------------------------------------------
+
+async def _warm_anthropic() -> None:
+    if not ANTHROPIC_API_KEY:
+        return
+    # Any response will do: the point is a pooled, already-handshaken TLS connection
+    await _anthropic._client.head(str(_anthropic.base_url))
+
 
-    text = re.sub(r'```json\s*\{.*?\}\s*```', '', text, flags=re.DOTALL)
-    text = re.sub(r'`\{[^`]+\}`', '', text)
-    text = re.sub(r'\n\s*\{[^{}]*"type"\s*:[^{}]*\}\s*\n?', '\n', text, flags=re.DOTALL)
-    text = re.sub(r'\n{3,}', '\n\n', text)
+@app.on_event("startup")
+async def warmup():
+    """
+    Moves cold-path latency out of the first user request: fetches the
+    Firebase JWKS, opens a TLS connection to the Claude API and formats
+    today's system prompt. Failures are logged, never fatal.
+    """
+    results = await asyncio.gather(
+        run_in_threadpool(_jwks.get_signing_keys),
+        _warm_anthropic(),
+        return_exceptions=True,
+    )
+    for name, result in zip(("Firebase JWKS", "Anthropic connection"), results):
+        if isinstance(result, Exception):
+            logger.warning("Warm-up of %s failed: %s", name, result)
 
-    return text.strip()
+    build_system_prompt()
 
 
 # -----------------------------------------------------------------------------
@@ -307,20 +514,27 @@ async def health():
     return {"status": "healthy"}
 
 
-@app.post("/assistant/chat", response_model=ChatResponse)
+# ChatResponse documents the reply shape only; the dict is serialized directly
+@app.post(
+    "/assistant/chat",
+    responses={200: {"model": ChatResponse}},
+    openapi_extra=_CHAT_REQUEST_BODY,
+)
 async def assistant_chat(
-    request: ChatRequest,
-    claims: Dict[str, Any] = Depends(require_firebase_user),
+    http_request: Request,
+    creds: HTTPAuthorizationCredentials | None = Depends(_bearer),
 ):
     """
     Main chat endpoint (AUTH REQUIRED).
     Requires: Authorization: Bearer <Firebase ID token>
     """
+    request, claims = await read_authed_chat_request(http_request, creds)
+
     # Pull identity from token claims
     uid = claims.get("user_id") or claims.get("sub")
     email = claims.get("email")
 
-    logger.info(f"Chat request: '{request.text[:100]}...' uid={uid} email={email}")
+    logger.info("Chat request: '%s...' uid=%s email=%s", request.text[:100], uid, email)
 
     if not request.text.strip():
         raise HTTPException(status_code=400, detail="Message text is required")
@@ -331,11 +545,37 @@ async def assistant_chat(
     if not request.userEmail and email:
         request.userEmail = str(email)
 
-    reply, action = call_claude(request.text, request.context)
+    reply, action = await call_claude(request.text, request.context)
 
-    logger.info(f"Response: reply='{reply[:100]}...', action={action}")
+    logger.info("Response: reply='%s...', action=%s", reply[:100], action)
 
-    return ChatResponse(reply=reply, action=action)
+    return {"reply": reply, "action": action}
+
+
+@app.post("/assistant/chat/stream", openapi_extra=_CHAT_REQUEST_BODY)
+async def assistant_chat_stream(
+    http_request: Request,
+    creds: HTTPAuthorizationCredentials | None = Depends(_bearer),
+):
+    """
+    Streaming chat endpoint (AUTH REQUIRED), text/event-stream.
+    Requires: Authorization: Bearer <Firebase ID token>
+    """
+    request, claims = await read_authed_chat_request(http_request, creds)
+
+    uid = claims.get("user_id") or claims.get("sub")
+    email = claims.get("email")
+
+    logger.info("Chat stream request: '%s...' uid=%s email=%s", request.text[:100], uid, email)
+
+    if not request.text.strip():
+        raise HTTPException(status_code=400, detail="Message text is required")
+
+    return StreamingResponse(
+        stream_claude(request.text, request.context),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 # -----------------------------------------------------------------------------
@@ -344,8 +584,8 @@ async def assistant_chat(
 
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
-    logger.error(f"Unhandled exception: {exc}")
-    return JSONResponse(
+    logger.error("Unhandled exception: %s", exc)
+    return ORJSONResponse(
         status_code=500,
         content={
             "reply": "Sorry, something went wrong on the server.",
@@ -374,4 +614,11 @@ if __name__ == "__main__":
     print(f"Firebase:   {'✅ Locked to project ' + FIREBASE_PROJECT_ID if FIREBASE_PROJECT_ID else '⚠️ Not project-locked'}")
     print("=" * 60)
 
-    uvicorn.run(app, host="0.0.0.0", port=port)
+    # uvloop + httptools ship with uvicorn[standard]; uvloop has no Windows build
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=port,
+        loop="uvloop" if sys.platform == "linux" else "auto",
+        http="httptools",
+    )
@@ -0,0 +1,45 @@
+import time
+
+from action_parser import _find_json_spans, extract_action, split_action
+
+
+def test_extracts_bare_action():
+    reply = 'Sure!\n{"type": "add_subject", "name": "Latin"}\nDone.'
+    assert split_action(reply) == ("Sure!\n\nDone.", {"type": "add_subject", "name": "Latin"})
+
+
+def test_extracts_fenced_action_and_renames_action_key():
+    reply = 'Added!\n\n```json\n{"action": "add_student", "name": "Emma"}\n```\n\n\nAnything else?'
+    assert split_action(reply) == ("Added!\n\nAnything else?", {"type": "add_student", "name": "Emma"})
+
+
+def test_extracts_nested_action():
+    action, _, _ = extract_action('{"type": "add_assignment", "meta": {"x": 1}}')
+    assert action == {"type": "add_assignment", "meta": {"x": 1}}
+
+
+def test_braces_inside_strings_do_not_end_the_span():
+    action, _, _ = extract_action('{"type": "add_subject", "name": "a}b"}')
+    assert action == {"type": "add_subject", "name": "a}b"}
+
+
+def test_no_action_leaves_reply_untouched():
+    assert split_action("Emma has 3 assignments due.") == ("Emma has 3 assignments due.", None)
+
+
+def test_unclosed_brace_in_prose_does_not_hide_action():
+    reply = 'Type { to open a block. {"type": "add_subject", "name": "Latin"}'
+    assert extract_action(reply)[0] == {"type": "add_subject", "name": "Latin"}
+
+
+def test_quoted_brace_in_prose_does_not_hide_action():
+    reply = 'Press "{" first. {"type": "set_teacher_mood", "mood": null}'
+    assert extract_action(reply)[0] == {"type": "set_teacher_mood", "mood": None}
+
+
+def test_unclosed_braces_scan_in_linear_time():
+    # Rescanning after every unclosed "{" made this quadratic (seconds at 8k)
+    for text in ("{" * 20000, '{"' * 20000):
+        t0 = time.perf_counter()
+        assert list(_find_json_spans(text)) == []
+        assert time.perf_counter() - t0 < 0.5
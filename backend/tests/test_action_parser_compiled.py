@@ -0,0 +1,43 @@
+import importlib.util
+import os
+
+import pytest
+
+import action_parser
+
+# Runs in the Docker build, where mypyc's extension shadows action_parser.py
+if action_parser.__file__.endswith(".py"):
+    pytest.skip("action_parser is not compiled; run after mypyc", allow_module_level=True)
+
+_SOURCE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "action_parser.py")
+_spec = importlib.util.spec_from_file_location("action_parser_py", _SOURCE)
+pure = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(pure)
+
+REPLIES = [
+    "",
+    "No action here.",
+    'Sure!\n{"type": "add_subject", "name": "Latin"}\nDone.',
+    'Added!\n\n```json\n{"action": "add_student", "name": "Emma"}\n```\n\n\nAnything else?',
+    'x `{"type": "set_teacher_mood", "mood": null}` y',
+    '{"type": "add_assignment", "meta": {"x": 1}}',
+    '{"type": "add_subject", "name": "a}b \\" {"}',
+    'Type { to open a block. {"type": "add_subject", "name": "Latin"}',
+    'Press "{" first. {"type": "set_teacher_mood", "mood": null}',
+    "{ { {x} {y {z}} ",
+    "{not json} {}",
+    "{" * 5000,
+    '{"' * 5000,
+    "}" * 5000 + '{"type": "t"}',
+]
+
+
+def test_compiled_module_is_loaded():
+    assert not action_parser.__file__.endswith(".py")
+
+
+@pytest.mark.parametrize("reply", REPLIES)
+def test_compiled_matches_pure_python(reply):
+    assert list(action_parser._find_json_spans(reply)) == list(pure._find_json_spans(reply))
+    assert action_parser.extract_action(reply) == pure.extract_action(reply)
+    assert action_parser.split_action(reply) == pure.split_action(reply)
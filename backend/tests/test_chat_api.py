@@ -0,0 +1,123 @@
+import time
+from types import SimpleNamespace
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi.testclient import TestClient
+from jwt.algorithms import RSAAlgorithm
+
+import main
+
+PROJECT_ID = "test-project"
+KID = "test-kid"
+_private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+_other_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def make_token(key=_private_key, uid="user-1", **overrides):
+    now = int(time.time())
+    claims = {
+        "iss": f"https://securetoken.google.com/{PROJECT_ID}",
+        "aud": PROJECT_ID,
+        "sub": uid,
+        "user_id": uid,
+        "email": "parent@example.com",
+        "iat": now,
+        "exp": now + 3600,
+        **overrides,
+    }
+    return jwt.encode(claims, key, algorithm="RS256", headers={"kid": KID})
+
+
+class FakeJWKS:
+    """Stands in for PyJWKClient, serving the test public key and counting fetches."""
+
+    def __init__(self):
+        jwk = RSAAlgorithm.to_jwk(_private_key.public_key(), as_dict=True)
+        self.keys = [jwt.PyJWK({**jwk, "kid": KID, "alg": "RS256"})]
+        self.calls = 0
+
+    def get_signing_keys(self, refresh=False):
+        self.calls += 1
+        return self.keys
+
+
+class FakeAnthropic:
+    def __init__(self, reply):
+        self.messages = self
+        self.reply = reply
+
+    async def create(self, **kwargs):
+        return SimpleNamespace(content=[SimpleNamespace(text=self.reply)])
+
+
+@pytest.fixture
+def jwks(monkeypatch):
+    fake = FakeJWKS()
+    monkeypatch.setattr(main, "_jwks", fake)
+    monkeypatch.setattr(main, "FIREBASE_PROJECT_ID", PROJECT_ID)
+    monkeypatch.setattr(main, "ANTHROPIC_API_KEY", "test-key")
+    monkeypatch.setattr(
+        main, "_anthropic", FakeAnthropic('Added!\n{"type": "add_subject", "name": "Latin"}')
+    )
+    main._verified_tokens.clear()
+    return fake
+
+
+@pytest.fixture
+def client(jwks):
+    # Not used as a context manager, so the startup warm-up doesn't run
+    return TestClient(main.app)
+
+
+def auth(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.mark.parametrize("body", [{"text": "Add Latin"}, {}])
+def test_missing_auth_is_401_even_with_bad_body(client, body):
+    res = client.post("/assistant/chat", json=body)
+    assert res.status_code == 401
+
+
+@pytest.mark.parametrize("token", ["not-a-jwt", make_token(key=_other_key)])
+def test_bad_token_is_401_even_with_bad_body(client, token):
+    res = client.post("/assistant/chat", content=b"{", headers=auth(token))
+    assert res.status_code == 401
+
+
+def test_missing_text_is_422_under_body(client):
+    res = client.post("/assistant/chat", json={}, headers=auth(make_token()))
+    assert res.status_code == 422
+    assert [e["loc"] for e in res.json()["detail"]] == [["body", "text"]]
+
+
+def test_invalid_json_is_422_at_body(client):
+    res = client.post(
+        "/assistant/chat",
+        content=b"{",
+        headers={**auth(make_token()), "Content-Type": "application/json"},
+    )
+    assert res.status_code == 422
+    assert [e["loc"] for e in res.json()["detail"]] == [["body"]]
+
+
+def test_whitespace_only_text_is_400(client):
+    res = client.post("/assistant/chat", json={"text": "   "}, headers=auth(make_token()))
+    assert res.status_code == 400
+
+
+def test_valid_request_returns_reply_and_action(client):
+    res = client.post("/assistant/chat", json={"text": "Add Latin"}, headers=auth(make_token()))
+    assert res.status_code == 200
+    assert res.json() == {"reply": "Added!", "action": {"type": "add_subject", "name": "Latin"}}
+
+
+def test_repeated_token_is_served_from_cache(client, jwks):
+    token = make_token()
+    for _ in range(3):
+        res = client.post("/assistant/chat", json={"text": "Add Latin"}, headers=auth(token))
+        assert res.status_code == 200
+    assert jwks.calls == 1
+    assert len(main._verified_tokens) == 1
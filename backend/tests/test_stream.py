@@ -0,0 +1,69 @@
+import asyncio
+import time
+
+import main
+
+
+class FakeStream:
+    """Stands in for AsyncAnthropic.messages.stream(); yields (delay, text) pairs."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    @property
+    def text_stream(self):
+        async def gen():
+            for delay, text in self.chunks:
+                await asyncio.sleep(delay)
+                yield text
+
+        return gen()
+
+
+class FakeAnthropic:
+    def __init__(self, chunks):
+        self.messages = self
+        self.chunks = chunks
+
+    def stream(self, **kwargs):
+        return FakeStream(self.chunks)
+
+
+def collect(monkeypatch, chunks):
+    monkeypatch.setattr(main, "ANTHROPIC_API_KEY", "test-key")
+    monkeypatch.setattr(main, "_anthropic", FakeAnthropic(chunks))
+
+    async def run():
+        t0 = time.perf_counter()
+        return [(time.perf_counter() - t0, event) async for event in main.stream_claude("hi")]
+
+    return asyncio.run(run())
+
+
+def test_first_delta_is_not_held_back(monkeypatch):
+    events = collect(monkeypatch, [(0.0, "Hi"), (0.3, " there")])
+    elapsed, first = events[0]
+    assert first == 'data: {"delta":"Hi"}\n\n'
+    assert elapsed < main.STREAM_FLUSH_SECONDS / 2
+
+
+def test_pending_text_is_flushed_while_the_model_pauses(monkeypatch):
+    events = collect(monkeypatch, [(0.0, "Hi"), (0.01, " there"), (0.4, ".")])
+    elapsed, second = events[1]
+    assert second == 'data: {"delta":" there"}\n\n'
+    assert elapsed < 0.3
+
+
+def test_stream_ends_with_reply_and_action(monkeypatch):
+    events = collect(monkeypatch, [(0.0, "Added!\n"), (0.0, '{"type": "add_subject", "name": "Latin"}')])
+    deltas = "".join(e for _, e in events[:-1])
+    assert "Added!" in deltas
+    assert events[-1][1] == (
+        'event: action\ndata: {"reply":"Added!","action":{"type":"add_subject","name":"Latin"}}\n\n'
+    )